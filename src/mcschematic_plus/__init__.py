@@ -5,6 +5,8 @@ Generate Minecraft .schem and .nbt structures from data.
 from .mcschematic_plus import MCSchematicPlus
 from .data_loaders import (
     to_mc_volume,
+    to_mc_bool_volume,
+    PackedVolume,
     read_tiff,
     read_npy,
     read_image,
@@ -0,0 +1,76 @@
+"""
+Direct encoder for the fixed tag layout of the .nbt structure files written by MCSchematicPlus.saveNBT.
+Produces the same bytes as building the tags with nbtlib and writing them, without a tag object per value.
+"""
+import io
+import struct
+import numpy as np
+from nbtlib.tag import Compound
+
+_END, _INT, _STRING, _LIST, _COMPOUND = 0, 3, 8, 9, 10
+
+# A block compound without block entity nbt: {state: Int, pos: List[Int] of length 3}
+_BLOCK_DTYPE = np.dtype([
+    ("state_header", "S8"),
+    ("state", ">i4"),
+    ("pos_header", "S11"),
+    ("pos", ">i4", (3,)),
+    ("end", "u1"),
+])
+
+def _tagHeader(tagId: int, name: str) -> bytes:
+    encoded = name.encode("utf-8")
+    return struct.pack(">bH", tagId, len(encoded)) + encoded
+
+def _string(tagName: str, value: str) -> bytes:
+    encoded = value.encode("utf-8")
+    return _tagHeader(_STRING, tagName) + struct.pack(">H", len(encoded)) + encoded
+
+def _listHeader(name: str, subtype: int, length: int) -> bytes:
+    return _tagHeader(_LIST, name) + struct.pack(">bi", subtype, length)
+
+_STATE_HEADER = _tagHeader(_INT, "state")
+_POS_HEADER = _listHeader("pos", _INT, 3)
+_NBT_HEADER = _tagHeader(_COMPOUND, "nbt")
+
+def encodeStructure(dataVersion: int, size: tuple[int, int, int], palette: list[tuple[str, tuple[tuple[str, str], ...] | None]],
+                    states: np.ndarray, relPositions: np.ndarray, blockNBTs: dict[int, Compound]) -> bytes:
+    """
+    Encode a structure file named "Schematic". palette lists (name, properties) entries, states and relPositions
+    ((3, N) array) give each block's palette index and position, and blockNBTs maps a block's index to its nbt.
+    """
+    parts = [_tagHeader(_COMPOUND, "Schematic"),
+             _tagHeader(_INT, "DataVersion"), struct.pack(">i", dataVersion),
+             _listHeader("size", _INT, 3), struct.pack(">3i", *size),
+             _listHeader("palette", _COMPOUND, len(palette))]
+    for name, properties in palette:
+        parts.append(_string("Name", name))
+        if properties is not None:
+            parts.append(_tagHeader(_COMPOUND, "Properties"))
+            parts.extend(_string(key, value) for key, value in dict(properties).items())
+            parts.append(bytes([_END]))
+        parts.append(bytes([_END]))
+
+    # Every block without nbt has the same fixed-size layout, so they are filled in as one record array
+    n = len(states)
+    parts.append(_listHeader("blocks", _COMPOUND, n))
+    blocks = np.zeros(n, dtype=_BLOCK_DTYPE)
+    blocks["state_header"] = _STATE_HEADER
+    blocks["state"] = states
+    blocks["pos_header"] = _POS_HEADER
+    blocks["pos"] = relPositions.T
+    start = 0
+    for i in sorted(blockNBTs):
+        parts.append(blocks[start:i].tobytes())
+        parts.append(blocks[i:i+1].tobytes()[:-1]) # reopen the compound to append the nbt tag
+        parts.append(_NBT_HEADER)
+        sink = io.BytesIO()
+        blockNBTs[i].write(sink)
+        parts.append(sink.getvalue())
+        parts.append(bytes([_END]))
+        start = i + 1
+    parts.append(blocks[start:].tobytes())
+
+    parts.append(_listHeader("entities", _COMPOUND, 0))
+    parts.append(bytes([_END]))
+    return b"".join(parts)
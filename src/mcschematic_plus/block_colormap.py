@@ -2,9 +2,7 @@ import csv
 from typing import Sequence
 import numpy as np
 import os
-from scipy.spatial import KDTree
 from importlib.resources import files
-from PIL import ImageColor
 
 _loaded_internal_colormaps = {}
 _INTERNAL_COLORMAPS = ["standard", "all", "smooth"]
@@ -40,6 +38,7 @@ class BlockColormap:
                 self._dict[block_state] = (r, g, b, a)
         self._block_states = np.array(bs)
         self._colors = np.array(cs)
+        from scipy.spatial import KDTree
         self._tree = KDTree(self._colors)
         self._alphas = np.array(alphas) # for now we don't query based on alpha
         self._map_cache : dict[tuple[int, int, int], str] = {} # cache for get_block to speed up repeated lookups
@@ -53,6 +52,7 @@ class BlockColormap:
         if np.issubdtype(rgb.dtype, np.number):
             rgb = rgb.astype(int)
         else:
+            from PIL import ImageColor
             vfunc = np.vectorize(ImageColor.getrgb) # convert color names to RGB tuples
             rgb = np.asarray(vfunc(rgb))
         rgb = rgb[..., :3]
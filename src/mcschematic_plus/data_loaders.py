@@ -1,20 +1,150 @@
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
-import pyvista as pv
-import tifffile
-from scipy.spatial import KDTree
-from PIL import Image
+import os
+from typing import TYPE_CHECKING
+if TYPE_CHECKING:
+    import pyvista as pv
+# pyvista, vtk, tifffile, scipy and PIL are imported by the functions that use them, so that importing the
+# package (e.g. only to build and save a structure) does not pay for loading them
 
 def to_mc_volume(arr: np.ndarray) -> np.ndarray:
     """
     Convert raw array in numpy/ImageJ format (z, y, x) = (Up, South, East) to Minecraft coordinates (x, y, z) = (East, Up, South).
+    The result is copied to C order so later passes over it read memory sequentially rather than through the transposed strides.
     """
-    return np.moveaxis(arr, 2, 0)
+    return np.ascontiguousarray(np.moveaxis(arr, 2, 0))
 
-def read_tiff(path: str) -> np.ndarray:
+_SDF_BATCH_SIZE = 1 << 20 # points per signed distance evaluation batch
+_REGION_SAMPLES = 16 # voxels evaluated per region outside the surface band to confirm its sign
+
+def _to_bool(arr: np.ndarray, true_value=None) -> np.ndarray:
+    out = np.empty(arr.shape, dtype=bool)
+    if true_value is None:
+        np.not_equal(arr, 0, out=out)
+    else:
+        np.equal(arr, true_value, out=out)
+    return out
+
+class PackedVolume:
+    """
+    Boolean volume stored as bits packed along its last axis, using an eighth of the memory of a bool array.
+    Can be passed to MCSchematicPlus.placeVolume in place of a boolean mask. Volumes of the same shape can be
+    merged with |, & and - (and complemented with ~) without unpacking.
+    """
+    def __init__(self, bits: np.ndarray, shape: tuple[int, ...]):
+        self._bits = bits
+        self.shape = tuple(shape)
+
+    @classmethod
+    def pack(cls, volume: np.ndarray) -> "PackedVolume":
+        """Pack the nonzero voxels of `volume`."""
+        volume = np.asarray(volume, dtype=bool)
+        return cls(np.packbits(volume, axis=-1), volume.shape)
+
+    def _unpack(self, bits: np.ndarray) -> np.ndarray:
+        return np.unpackbits(bits, axis=-1, count=self.shape[-1]).view(bool)
+
+    def nonzero(self) -> tuple[np.ndarray, ...]:
+        """Indices of the True voxels in the same order as np.nonzero, unpacking one slab of the first axis at a time."""
+        parts = []
+        for i in range(self.shape[0]):
+            idx = np.nonzero(self._unpack(self._bits[i]))
+            parts.append((np.full(len(idx[0]), i, dtype=np.intp), *idx))
+        if not parts:
+            return tuple(np.empty(0, dtype=np.intp) for _ in self.shape)
+        return tuple(np.concatenate(axis_idx) for axis_idx in zip(*parts))
+
+    def __array__(self, dtype=None, copy=None):
+        volume = self._unpack(self._bits)
+        return volume if dtype is None else volume.astype(dtype)
+
+    @staticmethod
+    def _lanes(bits: np.ndarray) -> np.ndarray:
+        """View the packed bytes as uint64 lanes (64 voxels per operation) when the buffer allows, else as bytes."""
+        bits = bits.reshape(-1)
+        return bits.view(np.uint64) if bits.nbytes % 8 == 0 else bits
+
+    def _combine(self, other: "PackedVolume", op) -> "PackedVolume":
+        if not isinstance(other, PackedVolume):
+            return NotImplemented
+        if other.shape != self.shape:
+            raise ValueError(f"shape mismatch: {self.shape} and {other.shape}")
+        bits = np.empty_like(self._bits)
+        op(self._lanes(self._bits), self._lanes(other._bits), out=self._lanes(bits))
+        return PackedVolume(bits, self.shape)
+
+    def __or__(self, other: "PackedVolume") -> "PackedVolume":
+        """Union of two volumes, computed on the packed bits."""
+        return self._combine(other, np.bitwise_or)
+
+    def __and__(self, other: "PackedVolume") -> "PackedVolume":
+        """Intersection of two volumes, computed on the packed bits."""
+        return self._combine(other, np.bitwise_and)
+
+    def __sub__(self, other: "PackedVolume") -> "PackedVolume":
+        """Voxels of this volume not in `other` (a & ~b), e.g. to let a later layer overwrite an earlier one."""
+        return self._combine(other, lambda a, b, out: np.bitwise_and(a, np.invert(b), out=out))
+
+    def __invert__(self) -> "PackedVolume":
+        """Complement of the volume. The padding bits of each row are flipped too but are never unpacked."""
+        bits = np.empty_like(self._bits)
+        np.invert(self._lanes(self._bits), out=self._lanes(bits))
+        return PackedVolume(bits, self.shape)
+
+def to_mc_bool_volume(arr: np.ndarray, true_value=None, packed: bool = False) -> np.ndarray | PackedVolume:
+    """
+    Convert raw array in numpy/ImageJ format (z, y, x) = (Up, South, East) to a boolean volume in Minecraft coordinates (x, y, z) = (East, Up, South).
+    Voxels are True where `arr` is nonzero, or where `arr` equals `true_value` if it is given.
+    The comparison is written directly into a C-contiguous output, so the input is traversed only once.
+    If `packed` is True, a PackedVolume is built one slab at a time so the full boolean volume is never held in memory.
+    """
+    src = np.moveaxis(np.asarray(arr), 2, 0)
+    if packed:
+        bits = np.empty(src.shape[:-1] + ((src.shape[-1] + 7) // 8,), dtype=np.uint8)
+        for i in range(src.shape[0]):
+            bits[i] = np.packbits(_to_bool(src[i], true_value), axis=-1)
+        return PackedVolume(bits, src.shape)
+    return _to_bool(src, true_value)
+
+def read_tiff(path: str, maxworkers: int | None = None, buffersize: int | None = None, memmap: bool = False) -> np.ndarray:
     """
     Read a multi-page TIFF file (z, y, x) = (Up, South, East) and return a volume in Minecraft coordinates (x, y, z) = (East, Up, South).
+    Each page is decoded straight into its slice of the output, so the file is never held in memory in both layouts.
+    `maxworkers` is the number of threads used to decode pages in parallel (or the strips or tiles of a single page);
+    None uses the number of CPUs. `buffersize` is the approximate number of bytes read from the file in one pass;
+    None uses the tifffile default.
+    If `memmap` is True and the image data are stored uncompressed and contiguously, a read-only view of the memory-mapped
+    file is returned instead, so only the parts that are accessed are read. Otherwise the file is decoded as usual.
     """
-    return to_mc_volume(tifffile.imread(path))
+    import tifffile
+    if maxworkers is None:
+        maxworkers = os.cpu_count() or 1
+    if memmap:
+        try:
+            return np.moveaxis(tifffile.memmap(path, mode="r"), 2, 0)
+        except ValueError: # compressed or not contiguous
+            pass
+    with tifffile.TiffFile(path) as tif:
+        series = tif.series[0]
+        shape = series.shape
+        if len(shape) < 3 or len(series) != shape[0]: # pages do not map one-to-one onto z slices
+            return to_mc_volume(series.asarray(maxworkers=maxworkers, buffersize=buffersize))
+        out = np.empty((shape[2], shape[0], shape[1]) + shape[3:], dtype=series.dtype)
+        # tifffile may parse the pages lazily, seeking the shared file handle, so load them all here before any thread runs
+        pages = list(series)
+        workers = min(len(pages), maxworkers or 1)
+        if workers > 1:
+            # pages decode independently and the codecs release the GIL, so decode several pages at once;
+            # the file handle lock serializes the reads and each thread writes a disjoint z slice
+            tif.filehandle.set_lock(True)
+            def decode(z: int):
+                out[:, z] = np.swapaxes(pages[z].asarray(maxworkers=1, buffersize=buffersize), 0, 1) # (y, x) -> (x, y)
+            with ThreadPoolExecutor(workers) as executor:
+                list(executor.map(decode, range(len(pages))))
+        else:
+            for z, page in enumerate(pages):
+                out[:, z] = np.swapaxes(page.asarray(maxworkers=maxworkers, buffersize=buffersize), 0, 1) # (y, x) -> (x, y)
+    return out
 
 def read_npy(path: str) -> np.ndarray:
     """
@@ -26,6 +156,7 @@ def read_image(path: str) -> np.ndarray:
     """
     Read a 2D image file (y, x) = (South, East) and return a volume in Minecraft coordinates (x, y, z) = (East, Up, South) with a single layer of voxels.
     """
+    from PIL import Image
     img = Image.open(path)
     # add z axis with size 1 and convert to numpy array
     return to_mc_volume(np.array(img)[None, ...])
@@ -41,6 +172,7 @@ def read_mesh(filename: str,
               edge_mode: str = "center",
               method: str = "implicit_distance",
               compute_scalars: bool = True,
+              narrow_band: bool = True,
               ) -> tuple[np.ndarray, np.ndarray, np.ndarray | None]:
     """
     Load a mesh (x, y, z) = (East, North, Up) and convert to a boolean voxel volume in Minecraft coordinates (x, y, z) = (East, Up, South).
@@ -72,6 +204,10 @@ def read_mesh(filename: str,
         'implicit_distance' uses PyVista's built-in method. Default is "implicit_distance".
     compute_scalars : bool, optional
         If True, compute the nearest mesh scalar value at each voxel. For example, RGB colors. Default is True.
+    narrow_band : bool, optional
+        If True, compute exact distances only for voxels near the mesh surface and take the sign of the remaining
+        voxels from a coarser sampling (or skip them entirely when `fill` is False). If False, evaluate the distance
+        at every voxel. Default is True.
     
     Returns
     -------
@@ -94,13 +230,183 @@ def read_mesh(filename: str,
         edge_mode=edge_mode,
         method=method,
         compute_scalars=compute_scalars,
+        narrow_band=narrow_band,
     )
     voxel_mask = to_mc_volume(vol)
     position = position[[2, 0, 1]]  # (Up, South, East) to (East, Up, South)
     scalars = to_mc_volume(scalars) if scalars is not None else None
     return voxel_mask, position, scalars
 
-def voxelize_mesh(mesh: pv.PolyData | str,
+def _sample_implicit_distance(mesh: 'pv.PolyData', origin: np.ndarray, spacing: np.ndarray, dimensions: np.ndarray) -> np.ndarray:
+    """
+    Evaluate the signed distance to `mesh` on a regular grid with x varying fastest. VTK walks the grid points
+    itself, so no point array is built in Python and the whole grid is evaluated in a single call.
+    """
+    from vtkmodules.vtkFiltersCore import vtkImplicitPolyDataDistance
+    from vtkmodules.vtkImagingHybrid import vtkSampleFunction
+    from vtkmodules.util.numpy_support import vtk_to_numpy
+    function = vtkImplicitPolyDataDistance()
+    function.SetInput(mesh)
+    sampler = vtkSampleFunction()
+    sampler.SetImplicitFunction(function)
+    sampler.SetSampleDimensions(*(int(n) for n in dimensions))
+    end = origin + (dimensions - 1) * spacing
+    sampler.SetModelBounds(origin[0], end[0], origin[1], end[1], origin[2], end[2])
+    sampler.SetOutputScalarTypeToDouble()
+    sampler.ComputeNormalsOff()
+    sampler.Update()
+    return vtk_to_numpy(sampler.GetOutput().GetPointData().GetScalars())
+
+def _implicit_distance_function(mesh: 'pv.PolyData'):
+    """Return a function evaluating the signed distance to `mesh` at an (N, 3) array of points in one VTK call."""
+    from vtkmodules.vtkCommonCore import vtkDoubleArray
+    from vtkmodules.vtkFiltersCore import vtkImplicitPolyDataDistance
+    from vtkmodules.util.numpy_support import numpy_to_vtk, vtk_to_numpy
+    function = vtkImplicitPolyDataDistance()
+    function.SetInput(mesh)
+    def evaluate(points: np.ndarray) -> np.ndarray:
+        dists = vtkDoubleArray()
+        function.FunctionValue(numpy_to_vtk(np.ascontiguousarray(points, dtype=float)), dists)
+        return vtk_to_numpy(dists)
+    return evaluate
+
+def _surface_within_function(mesh: 'pv.PolyData'):
+    """
+    Return a function reporting, for an (N, 3) array of points, whether the surface of the triangle mesh `mesh` lies
+    within `radius` of each point. One KD-tree query against the triangle centroids settles most points: a centroid
+    within `radius` is on the surface, and a point farther than `radius` plus the largest centroid-to-vertex distance
+    from every centroid is farther than `radius` from every triangle. Only the points in between are checked one at a
+    time with a static cell locator.
+    """
+    from scipy.spatial import KDTree
+    from vtkmodules.vtkCommonCore import reference
+    from vtkmodules.vtkCommonDataModel import vtkStaticCellLocator, vtkGenericCell
+    triangles = np.asarray(mesh.points)[mesh.faces.reshape(-1, 4)[:, 1:]]
+    centroids = triangles.mean(axis=1)
+    triangle_reach = np.linalg.norm(triangles - centroids[:, None], axis=2).max(initial=0.0)
+    tree = KDTree(centroids)
+    locator = vtkStaticCellLocator()
+    locator.SetDataSet(mesh)
+    locator.BuildLocator()
+    closest, cell, cell_id, sub_id, dist2 = [0.0, 0.0, 0.0], vtkGenericCell(), reference(0), reference(0), reference(0.0)
+    def within(points: np.ndarray, radius: float) -> np.ndarray:
+        centroid_dist, _ = tree.query(points, distance_upper_bound=radius + triangle_reach)
+        found = centroid_dist <= radius
+        undecided = np.flatnonzero(~found & np.isfinite(centroid_dist))
+        for i, point in zip(undecided.tolist(), points[undecided].tolist()):
+            found[i] = locator.FindClosestPointWithinRadius(point, radius, closest, cell, cell_id, sub_id, dist2)
+        return found
+    return within
+
+def _evaluate_grid(evaluate, origin: np.ndarray, spacing: np.ndarray, dimensions: np.ndarray) -> np.ndarray:
+    """
+    Evaluate a function of (N, 3) points at every point of a regular grid with x varying fastest, generating the
+    points one batch at a time instead of materializing them all. Returns a (z, y, x) array.
+    """
+    n = int(np.prod(dimensions))
+    values = None
+    for start in range(0, n, _SDF_BATCH_SIZE):
+        stop = min(start + _SDF_BATCH_SIZE, n)
+        zyx = np.unravel_index(np.arange(start, stop), tuple(dimensions[::-1]))
+        batch = evaluate(origin + np.stack(zyx[::-1], axis=1) * spacing)
+        if values is None:
+            values = np.empty(n, dtype=batch.dtype)
+        values[start:stop] = batch
+    return values.reshape(tuple(dimensions[::-1]))
+
+def _triangle_band_mask(mesh: 'pv.PolyData', origin: np.ndarray, spacing: np.ndarray, dimensions: np.ndarray, band: float,
+                        fat: int = 27) -> np.ndarray:
+    """
+    Return a (z, y, x) mask of the grid points inside the bounding box of some triangle of `mesh` grown by `band`.
+    Every grid point within `band` of the surface is inside the box of its closest triangle, so it is marked.
+    Boxes of more than `fat` points are mostly far from a large or slanted triangle, so there only the points within
+    `band` of the triangle's plane are marked.
+    """
+    triangles = mesh.points[mesh.faces.reshape(-1, 4)[:, 1:]].astype(float)
+    lo = np.ceil((triangles.min(axis=1) - band - origin) / spacing).astype(np.int64)
+    hi = np.floor((triangles.max(axis=1) + band - origin) / spacing).astype(np.int64) + 1 # exclusive
+    lo = np.clip(lo, 0, dimensions)
+    hi = np.clip(hi, 0, dimensions)
+    normals = np.cross(triangles[:, 1] - triangles[:, 0], triangles[:, 2] - triangles[:, 0])
+    lengths = np.linalg.norm(normals, axis=1)
+    is_fat = (np.prod(hi - lo, axis=1) > fat) & (lengths > 0)
+    mask = np.zeros(tuple(dimensions[::-1]), dtype=bool)
+    for (x0, y0, z0), (x1, y1, z1) in zip(lo[~is_fat].tolist(), hi[~is_fat].tolist()):
+        mask[z0:z1, y0:y1, x0:x1] = True
+    for i in np.flatnonzero(is_fat).tolist():
+        (x0, y0, z0), (x1, y1, z1) = lo[i].tolist(), hi[i].tolist()
+        normal = normals[i] / lengths[i]
+        # the distance to the plane is a sum of per-axis terms, so it broadcasts over the box
+        dx, dy, dz = ((origin[k] + np.arange(lo[i, k], hi[i, k]) * spacing[k] - triangles[i, 0, k]) * normal[k] for k in range(3))
+        mask[z0:z1, y0:y1, x0:x1] |= np.abs(dz[:, None, None] + dy[None, :, None] + dx[None, None, :]) <= band
+    return mask
+
+def _narrow_band_sdf(evaluate, origin: np.ndarray, spacing: np.ndarray, dimensions: np.ndarray, band: float, block: int = 4,
+                     within=None) -> np.ndarray:
+    """
+    Evaluate a signed distance function on a regular grid, computing exact values only near the surface.
+
+    The distance is first sampled on a grid `block` times coarser. A signed distance changes by at most the
+    distance moved, so a voxel whose nearest coarse sample is farther from the surface than `band` plus the
+    offset to that sample is on the same side of the surface and more than `band` away; it keeps the coarse
+    value. Only the remaining voxels are evaluated. Returns a (z, y, x) array that is exact where |sdf| <= band.
+
+    If `within(points, radius)` is given, remaining voxels whose coarse sample is farther from the surface than
+    the offset to it are first checked for surface within `band`; those without any keep the coarse sign.
+    """
+    coarse, nearest = [], []
+    for n in dimensions:  # x, y, z
+        samples = np.unique(np.r_[np.arange(0, n, block), n - 1])
+        coarse.append(samples)
+        nearest.append(np.searchsorted((samples[:-1] + samples[1:]) / 2, np.arange(n)))
+    gz, gy, gx = np.meshgrid(coarse[2], coarse[1], coarse[0], indexing="ij")
+    coarse_points = origin + np.stack([gx.ravel(), gy.ravel(), gz.ravel()], axis=1) * spacing
+    coarse_sdf = evaluate(coarse_points).reshape(gz.shape)
+    sdf = coarse_sdf[np.ix_(nearest[2], nearest[1], nearest[0])]
+    reach = np.linalg.norm(block / 2 * spacing)
+    near = np.nonzero(np.abs(sdf) <= band + reach)
+    points = origin + np.stack(near[::-1], axis=1) * spacing
+    values = sdf[near]
+    exact = np.ones(len(values), dtype=bool)
+    if within is not None:
+        # the coarse sample is on the same side of the surface as the voxel, which has no surface within band
+        same_side = np.flatnonzero(np.abs(values) > reach)
+        exact[same_side[~within(points[same_side], band)]] = False
+        far = values[~exact]
+        values[~exact] = np.copysign(np.maximum(np.abs(far), np.nextafter(band, np.inf)), far)
+    values[exact] = evaluate(points[exact])
+    sdf[near] = values
+    return sdf
+
+def _fill_band_regions(evaluate, sdf: np.ndarray, near_mask: np.ndarray, origin: np.ndarray, spacing: np.ndarray,
+                       samples: int = _REGION_SAMPLES) -> None:
+    """
+    Set the sign of the (z, y, x) `sdf` voxels outside `near_mask`, in place, to -inf inside the surface.
+
+    The voxels outside the band form connected regions that do not touch the surface. A closed surface that does not
+    intersect itself puts each region entirely inside or outside, but the distance to a self-intersecting one (such as
+    a union of overlapping parts) can change sign within a region. So up to `samples` voxels spread through each
+    region are evaluated, and a region takes their sign only when they agree; otherwise all its voxels are evaluated.
+    """
+    from scipy import ndimage
+    labels, n = ndimage.label(~near_mask)
+    if not n:
+        return
+    flat_labels = labels.reshape(-1)
+    order = np.argsort(flat_labels, kind="stable")[np.count_nonzero(near_mask):] # region voxels grouped by label
+    counts = np.bincount(flat_labels, minlength=n + 1)[1:]
+    starts = np.cumsum(counts) - counts
+    picks = starts[:, None] + (np.linspace(0, 1, samples) * (counts - 1)[:, None]).astype(np.intp) # (n, samples)
+    zyx = np.unravel_index(order[picks.reshape(-1)], labels.shape)
+    inside = (evaluate(origin + np.stack(zyx[::-1], axis=1) * spacing) < 0).reshape(n, samples)
+    agreed = inside.all(axis=1) | ~inside.any(axis=1)
+    sdf[np.r_[False, agreed & inside[:, 0]][labels]] = -np.inf
+    mixed = np.flatnonzero(~agreed) + 1
+    if len(mixed):
+        exact = np.nonzero(np.isin(labels, mixed))
+        sdf[exact] = evaluate(origin + np.stack(exact[::-1], axis=1) * spacing)
+
+def voxelize_mesh(mesh: 'pv.PolyData | str',
                    spacing: float | tuple = 1.0,
                    minimum: tuple = None,
                    maximum: tuple = None,
@@ -111,6 +417,7 @@ def voxelize_mesh(mesh: pv.PolyData | str,
                    edge_mode: str = "center",
                    method: str = "implicit_distance",
                    compute_scalars: bool = True,
+                   narrow_band: bool = True,
                    ) -> tuple[np.ndarray, np.ndarray, np.ndarray | None]:
     """
     Load a mesh (x, y, z) = (East, North, Up) and convert to a boolean voxel volume (z, y, x) = (Up, South, East).
@@ -142,6 +449,10 @@ def voxelize_mesh(mesh: pv.PolyData | str,
         'implicit_distance' uses PyVista's built-in method. Default is "implicit_distance".
     compute_scalars : bool, optional
         If True, compute the nearest mesh scalar value at each voxel. For example, RGB colors. Default is True.
+    narrow_band : bool, optional
+        If True, compute exact distances only for voxels near the mesh surface and take the sign of the remaining
+        voxels from a coarser sampling (or skip them entirely when `fill` is False). If False, evaluate the distance
+        at every voxel. Default is True.
 
     Returns
     -------
@@ -152,13 +463,16 @@ def voxelize_mesh(mesh: pv.PolyData | str,
     scalars : (z, y, x, N) ndarray or None
         Scalar value at each voxel, if `compute_scalars` is True. Otherwise, None.
     """
-    # Ensure triangular mesh TODO: is this necessary?
+    import pyvista as pv
+    from scipy.spatial import KDTree
     mesh = pv.read(mesh) if isinstance(mesh, str) else mesh
     if isinstance(mesh, pv.MultiBlock):
         mesh = mesh.extract_surface(algorithm=None)
     elif not isinstance(mesh, pv.PolyData):
         mesh = pv.PolyData(mesh) # last resort
-    mesh = mesh.triangulate()
+    # Ensure triangular mesh TODO: is this necessary?
+    if not mesh.is_all_triangles or mesh.n_strips: # skip the full copy for meshes that are already triangles
+        mesh = mesh.triangulate()
     mins, maxs = np.array(mesh.bounds[::2], dtype=float), np.array(mesh.bounds[1::2], dtype=float)
     min_mesh = mins.copy()
     if minimum is not None:
@@ -179,11 +493,18 @@ def voxelize_mesh(mesh: pv.PolyData | str,
         
     spacing = np.array((spacing, spacing, spacing), float) if np.isscalar(spacing) else np.array(spacing, float)
     nxyz = np.ceil((max_mesh - min_mesh) / spacing).astype(int) + 1  # include endpoint
-    grid = pv.ImageData(
-        dimensions=nxyz,
-        spacing=spacing,
-        origin=min_mesh,
-    )
+    voxel_diagonal = np.linalg.norm(spacing)
+
+    epsilon = 0.1
+    if edge_mode == "center":
+        lower, upper = -voxel_diagonal * (0.5), voxel_diagonal * (0.5)
+    elif edge_mode == "inner":
+        lower, upper = -voxel_diagonal * (0.5 + epsilon), 0.0
+    elif edge_mode == "outer":
+        lower, upper = 0.0, voxel_diagonal * (0.5 + epsilon)
+    else:
+        raise ValueError("edge_mode must be one of {'center','inner','outer'}")
+
     if method == "mesh_to_sdf":
         try:
             import trimesh
@@ -191,35 +512,58 @@ def voxelize_mesh(mesh: pv.PolyData | str,
         except ImportError:
             raise ImportError("trimesh and mesh_to_sdf are required for 'mesh_to_sdf' method. Please install them via 'pip install trimesh mesh_to_sdf'.")
         trimesh_mesh = trimesh.Trimesh(vertices=mesh.points, faces=mesh.faces.reshape((-1, 4))[:, 1:4])
-        points = grid.points
-        sdf_values = mesh_to_sdf.mesh_to_sdf(trimesh_mesh, points)
+        cloud = mesh_to_sdf.get_surface_point_cloud(trimesh_mesh)
+        def evaluate(points: np.ndarray) -> np.ndarray:
+            # single precision halves the memory traffic, and batches keep the working set bounded
+            points = np.asarray(points, dtype=np.float32)
+            sdf_values = np.empty(len(points), dtype=np.float32)
+            for start in range(0, len(points), _SDF_BATCH_SIZE):
+                batch = points[start:start + _SDF_BATCH_SIZE]
+                sdf_values[start:start + _SDF_BATCH_SIZE] = cloud.get_sdf(batch, use_depth_buffer=False)
+            return sdf_values
     elif method == "implicit_distance":
-        distancegrid = grid.compute_implicit_distance(mesh)
-        sdf_values = distancegrid.point_data["implicit_distance"]
-    sdf = sdf_values.reshape(grid.dimensions[::-1])  # (z,y,x)
-    voxel_diagonal = np.linalg.norm(spacing)
-
-    epsilon = 0.1
-    if edge_mode == "center":
-        mask = np.abs(sdf) <= voxel_diagonal * (0.5)
-    elif edge_mode == "inner":
-        mask = (sdf <= 0.0) & (sdf >= -voxel_diagonal * (0.5 + epsilon))
-    elif edge_mode == "outer":
-        mask = (sdf >= 0.0) & (sdf <= voxel_diagonal * (0.5 + epsilon))
+        evaluate = _implicit_distance_function(mesh)
     else:
-        raise ValueError("edge_mode must be one of {'center','inner','outer'}")
-    if fill:
-        inside = sdf < 0.0
-        mask = inside | mask
+        raise ValueError("method must be one of {'mesh_to_sdf','implicit_distance'}")
+    if narrow_band and fill and mesh.n_open_edges:
+        # regions away from an open surface can reach both sides of it, so take the sign from a coarser sampling
+        sdf = _narrow_band_sdf(evaluate, min_mesh, spacing, nxyz, band=max(-lower, upper), within=_surface_within_function(mesh))
+    elif narrow_band:
+        # the mask only compares sdf against thresholds no farther than this from the surface,
+        # and every voxel within the band lies inside the grown triangle boxes
+        band = max(-lower, upper)
+        near_mask = _triangle_band_mask(mesh, min_mesh, spacing, nxyz, band)
+        near = np.nonzero(near_mask)
+        sdf = np.full(tuple(nxyz[::-1]), np.inf)
+        sdf[near] = evaluate(min_mesh + np.stack(near[::-1], axis=1) * spacing)
+        if fill:
+            _fill_band_regions(evaluate, sdf, near_mask, min_mesh, spacing)
+    elif method == "implicit_distance":
+        sdf = _sample_implicit_distance(mesh, min_mesh, spacing, nxyz).reshape(nxyz[::-1])  # (z,y,x)
+    else:
+        sdf = _evaluate_grid(evaluate, min_mesh, spacing, nxyz)
+
+    if flip_y:
+        sdf = sdf[:, ::-1, :] # flip before masking so the mask is written in its final order
+
+    # Each edge mode keeps lower <= sdf <= upper. Filling adds the interior (sdf < 0),
+    # which leaves only the upper bound, so the mask is built in one or two passes over sdf.
+    mask = sdf <= upper
+    if not fill:
+        mask &= sdf >= lower
     scalars = None
     if compute_scalars:
         if mesh.active_scalars is None:
             raise ValueError("Mesh must have active scalars to use compute_scalars=True.")
         # get nearest point on the mesh for each voxel and get its scalar values
-        mask_grid_points = grid.points[mask.flatten()]
+        voxels = np.nonzero(mask)
+        z, y, x = voxels
+        if flip_y:
+            y = (mask.shape[1] - 1) - y
+        mask_grid_points = min_mesh + np.stack([x, y, z], axis=1) * spacing
         _, idx = KDTree(mesh.points).query(mask_grid_points)
         scalars = np.zeros(mask.shape + mesh.active_scalars.shape[1:], dtype=mesh.active_scalars.dtype)
-        scalars[mask] = mesh.active_scalars[idx]
+        scalars[voxels] = mesh.active_scalars[idx]
     position = np.zeros(3, dtype=int)
     if origin is not None:
         vox_min = np.ceil(min_mesh / spacing).astype(int)
@@ -227,10 +571,7 @@ def voxelize_mesh(mesh: pv.PolyData | str,
         position = vox_min - vox_origin
         position = position[::-1] # to (z, y, x)
     if flip_y:
-        mask = mask[:, ::-1, :]
         position[1] = - ((mask.shape[1] - 1) + position[1])
-        if scalars is not None:
-            scalars = scalars[:, ::-1, :]
-    voxel_mask = mask.astype(bool)
+    voxel_mask = mask
 
     return voxel_mask, position, scalars
\ No newline at end of file
@@ -1,12 +1,113 @@
+import itertools
+import math
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+import gzip
+import io
 import numpy as np
 import os
-import pyvista as pv
-from typing import BinaryIO, Sequence
+from typing import BinaryIO, Iterable, Sequence, TYPE_CHECKING
 from mcschematic import MCSchematic, MCStructure, Version
 from nbtlib.tag import *
 from nbtlib import File, parse_nbt
 from .block_colormap import BlockColormap, get_block_colormap
+from .data_loaders import PackedVolume
+from . import _fastnbt
 import warnings
+if TYPE_CHECKING:
+    import pyvista as pv # imported where used, as it is slow to load
+
+@lru_cache(maxsize=None)
+def _parseBlockState(blockState: str) -> tuple[str, tuple[tuple[str, str], ...] | None]:
+    """Split a block state into its name and (key, value) properties, or None if it has no property list."""
+    block_name = blockState.split("[")[0]
+    if blockState.find("[") == -1:
+        return block_name, None
+    props_str = blockState[blockState.find("[")+1:blockState.find("]")]
+    properties = []
+    for prop in props_str.split(","):
+        if "=" in prop: # Safety check for malformed strings
+            key, value = prop.split("=")
+            properties.append((key, value))
+    return block_name, tuple(properties)
+
+def _writeGzipped(data: bytes | memoryview, target: str | os.PathLike | BinaryIO, compresslevel: int = 9, mtime: float | None = None):
+    """Write `data` gzipped to a path or binary file object. `compresslevel` and `mtime` are passed to gzip.GzipFile."""
+    if isinstance(target, (str, os.PathLike)):
+        fileobj = gzip.GzipFile(target, "wb", compresslevel=compresslevel, mtime=mtime)
+    else:
+        fileobj = gzip.GzipFile(fileobj=target, mode="wb", compresslevel=compresslevel, mtime=mtime)
+    with fileobj:
+        fileobj.write(data)
+
+def _writeGzippedNBT(nbtFile: File, target: str | os.PathLike | BinaryIO, compresslevel: int = 9, mtime: float | None = None):
+    """
+    Write `nbtFile` gzipped to a path or binary file object. The tag encoder issues one tiny write per value, so
+    the file is serialized into memory first and compressed with a single write instead of once per value.
+    """
+    buffer = io.BytesIO()
+    nbtFile.write(buffer, nbtFile.byteorder)
+    _writeGzipped(buffer.getbuffer(), target, compresslevel, mtime)
+
+def _saveNBTTile(path: str, dataVersion: int, tileSize: tuple[int, int, int], relPositions: np.ndarray,
+                 blockPaletteIds: np.ndarray, blockPalette: dict[int, str], blockEntities: dict[int, str]):
+    """
+    Write one .nbt structure tile. relPositions is a (3, N) array of block positions relative to the tile, blockPaletteIds
+    their ids in blockPalette, and blockEntities maps a block's index to its block entity string.
+    Kept at module level and free of shared state so tiles can be written from worker threads.
+    The file is encoded directly by _fastnbt unless the MCSCHEMATIC_PLUS_NBTLIB environment variable is set
+    to a non-empty value other than "0", in which case the tags are built and written with nbtlib.
+    """
+    # Palette, built from the tile's distinct palette ids only. replaceBlocks can leave several ids mapped to
+    # the same block state, so entries are keyed by the state string and each state is written once.
+    palette = [("minecraft:air", None)] # Always include air
+    tile_indices = {"minecraft:air": 0}
+    blockPaletteIds, inverse = np.unique(blockPaletteIds, return_inverse=True)
+    tile_states = np.zeros(len(blockPaletteIds), dtype=np.int64)
+    for k, blockPaletteId in enumerate(blockPaletteIds.tolist()):
+        blockState = blockPalette[blockPaletteId]
+        if blockState not in tile_indices:
+            tile_indices[blockState] = len(palette)
+            palette.append(_parseBlockState(blockState))
+        tile_states[k] = tile_indices[blockState]
+    states = tile_states[inverse.reshape(-1)]
+    blockNBTs = {}
+    for i, blockEntityString in blockEntities.items():
+        blockNBTs[i] = parse_nbt(blockEntityString[blockEntityString.find("{"):])
+
+    if os.environ.get("MCSCHEMATIC_PLUS_NBTLIB", "") in ("", "0"):
+        _writeGzipped(_fastnbt.encodeStructure(dataVersion, tileSize, palette, states, relPositions, blockNBTs), path)
+        return
+
+    root = Compound()
+    root["DataVersion"] = Int(dataVersion)
+    root["size"] = List[Int]([Int(tileSize[0]), Int(tileSize[1]), Int(tileSize[2])])
+
+    palette_tags = List[Compound]()
+    for block_name, properties in palette:
+        entry = Compound({"Name": String(block_name)})
+        if properties is not None:
+            entry["Properties"] = Compound({key: String(value) for key, value in properties})
+        palette_tags.append(entry)
+    # Int tags are immutable, so the bounded pos and state values can share one instance each
+    int_tags = [Int(i) for i in range(max(*tileSize, len(palette)))]
+
+    # Blocks
+    blocks = List[Compound]()
+
+    for i, (rel, state) in enumerate(zip(relPositions.T.tolist(), states.tolist())):
+        btag = Compound()
+        btag["state"] = int_tags[state]
+        btag["pos"] = List[Int]([int_tags[rel[0]], int_tags[rel[1]], int_tags[rel[2]]])
+        if i in blockNBTs:
+            btag["nbt"] = blockNBTs[i]
+        blocks.append(btag)
+
+    root["palette"] = palette_tags
+    root["blocks"] = blocks
+    root["entities"] = List[Compound]() # TODO: Add support for entities
+
+    _writeGzippedNBT(File(root, gzipped=True, root_name="Schematic"), path)
 
 class MCSchematicPlus(MCSchematic):
     def __init__(self, schematicToLoadPath_or_mcStructure: str | os.PathLike | MCStructure = None, version: 'Version' = None):
@@ -22,20 +123,63 @@ class MCSchematicPlus(MCSchematic):
                 except ImportError:
                     raise ImportError("To load non .schem files, please install the 'amulet-core' package")
                 level = amulet.load_level(os.path.abspath(schematicToLoadPath))
-                dim = "main"
-                sel = level.bounds(dim)
                 self._defaultInit()
                 version = ("java", version.value) if version is not None else ("java", self.getLatestVersion().value)
-                for x in range(sel.min_x, sel.max_x):
-                    for y in range(sel.min_y, sel.max_y):
-                        for z in range(sel.min_z, sel.max_z):
-                            block, blockEntity = level.get_version_block(x, y, z, dim, version=version)
-                            if block.namespaced_name != "minecraft:air":
-                                self.setBlock((x, y, z), block.full_blockstate)
+                self._placeLevelBlocks(level, "main", version)
                 level.close()
         else:
             super().__init__(schematicToLoadPath_or_mcStructure)
 
+    def _placeLevelBlocks(self, level, dim: str, version: tuple[str, int]):
+        """
+        Copy every non-air block inside the bounds of an amulet level. Blocks are read a sub-chunk array at a time
+        and each distinct palette entry is translated to `version` once rather than once per voxel.
+        """
+        from amulet.api.block import Block
+        sel = level.bounds(dim)
+        lo = np.array([sel.min_x, sel.min_y, sel.min_z])
+        hi = np.array([sel.max_x, sel.max_y, sel.max_z])
+        translator = level.translation_manager.get_version(*version).block
+
+        def translate(blockTuple, blockEntity=None):
+            output = translator.from_universal(blockTuple[0], blockEntity)[0]
+            for subBlock in blockTuple[1:]:
+                converted = translator.from_universal(subBlock)[0]
+                if isinstance(converted, Block):
+                    output += converted
+            return output
+
+        translated = {} # universal block -> version block state, or None for air
+        for cx, cz in level.all_chunk_coords(dim):
+            chunk = level.get_chunk(cx, cz, dim)
+            palette = chunk.block_palette
+            for cy in chunk.blocks.sub_chunks:
+                indices = chunk.blocks.get_sub_chunk(cy) # (x, y, z) palette indices
+                offset = np.array([cx, cy, cz]) * indices.shape
+                states = {}
+                for paletteIndex in np.unique(indices).tolist():
+                    block = palette[paletteIndex]
+                    if block not in translated:
+                        output = translate(block.block_tuple)
+                        isBlock = isinstance(output, Block) and output.namespaced_name != "minecraft:air"
+                        translated[block] = output.full_blockstate if isBlock else None
+                    states[paletteIndex] = translated[block]
+                for paletteIndex, blockState in states.items():
+                    if blockState is None:
+                        continue
+                    positions = np.argwhere(indices == paletteIndex) + offset
+                    positions = positions[np.all((positions >= lo) & (positions < hi), axis=1)]
+                    if len(positions):
+                        self._setBlockStates(positions, blockState)
+            # block entities can change how a block translates, so those positions are redone individually
+            for (x, y, z), blockEntity in chunk.block_entities.items():
+                if np.all((lo <= (x, y, z)) & ((x, y, z) < hi)):
+                    output = translate(chunk.get_block(x - 16*cx, y, z - 16*cz).block_tuple, blockEntity)
+                    if isinstance(output, Block) and output.namespaced_name != "minecraft:air":
+                        self.setBlock((x, y, z), output.full_blockstate)
+                    else:
+                        self._structure._blockStates.pop((x, y, z), None)
+
     # override methods to make placePosition optional, while maintaining backwards compatibility.
     def placeSchematic(self, incomingSchematic, placePosition=(0, 0, 0)):
         return super().placeSchematic(incomingSchematic, placePosition)
@@ -43,10 +187,21 @@ class MCSchematicPlus(MCSchematic):
     def placeStructure(self, incomingStructure, placePosition=(0, 0, 0)):
         return super().placeStructure(incomingStructure, placePosition)
 
-    def placeVolume(self, volumeMask: np.ndarray, blockData_or_color: str | np.ndarray | None, blockColormap: str | BlockColormap | None = None, placePosition: tuple[int, int, int] = (0, 0, 0)):
-        """Add blocks for every True voxel in volume_mask. The volume axes should be (x, y, z) = (East, Up, South)."""
-        volumeMask = np.asarray(volumeMask, dtype=bool)
-        positions = np.argwhere(volumeMask)  # shape (N, 3) with columns [x, y, z]
+    def placeVolume(self, volumeMask: np.ndarray | PackedVolume, blockData_or_color: str | np.ndarray | None, blockColormap: str | BlockColormap | None = None, placePosition: tuple[int, int, int] = (0, 0, 0)):
+        """Add blocks for every True (nonzero) voxel in volume_mask. The volume axes should be (x, y, z) = (East, Up, South)."""
+        if isinstance(volumeMask, PackedVolume):
+            voxels = volumeMask.nonzero()
+        else:
+            # nonzero voxels count as True for any dtype, so e.g. uint8 labels are used without a bool copy
+            volumeMask = np.asarray(volumeMask)
+            if volumeMask.ndim == 3 and isinstance(blockData_or_color, str) and blockColormap is None and blockData_or_color[-1] != '}':
+                box = self._getFilledBox(volumeMask)
+                if box is not None: # a solid cuboid can be placed without listing its voxels
+                    ranges = [range(lo + offset, hi + offset) for lo, hi, offset in zip(*box, placePosition)]
+                    self._setBlockStates(itertools.product(*ranges), blockData_or_color)
+                    return
+            voxels = np.nonzero(volumeMask)
+        positions = np.stack(voxels, axis=1)  # shape (N, 3) with columns [x, y, z]
         if positions.size == 0:
             return
         positions += np.array(placePosition)  # offset coordinates
@@ -55,7 +210,7 @@ class MCSchematicPlus(MCSchematic):
             if _bdoc_arr.ndim >= 3:
                 if _bdoc_arr.shape[:3] != volumeMask.shape:
                     raise ValueError("If blockData_or_color is an array, its first 3 dimensions must match the volume_mask shape")
-                blockData_or_color = _bdoc_arr[volumeMask]  # filter to only True voxels
+                blockData_or_color = _bdoc_arr[voxels]  # filter to only True voxels
         self.setBlocks(positions, blockData_or_color, blockColormap)
     
     def setBlocks(self, positions: np.ndarray, blockData_or_color: str | Sequence[str] | np.ndarray | None, blockColormap: str | BlockColormap | None = None):
@@ -83,11 +238,132 @@ class MCSchematicPlus(MCSchematic):
             else:
                 raise ValueError("If blockColormap is not provided, blockData_or_color must be a blockData string or a sequence of blockData strings.")
         if isinstance(blockData, str):
-            for x, y, z in positions:
-                self.setBlock((int(x), int(y), int(z)), blockData) # TODO slightly inefficient but simple
+            if blockData[-1] == '}': # block entities need their nbt stored per position
+                for x, y, z in positions:
+                    self.setBlock((int(x), int(y), int(z)), blockData)
+            else:
+                self._setBlockStates(positions, blockData)
         else:
-            for (x, y, z), bd in zip(positions, blockData):
-                self.setBlock((int(x), int(y), int(z)), str(bd))
+            blockData = np.asarray(blockData, dtype=str).tolist()
+            blockDatas = dict.fromkeys(blockData) # distinct blocks in order of first use
+            if any(bd[-1] == '}' for bd in blockDatas): # block entities need their nbt stored per position
+                for (x, y, z), bd in zip(positions, blockData):
+                    self.setBlock((int(x), int(y), int(z)), bd)
+                return
+            # Intern each distinct block once, then set every position in one dict update
+            structure = self._structure
+            for bd in blockDatas:
+                structure._addBlockStateToPaletteIfAbsent(bd)
+                blockDatas[bd] = structure._blockPalette[bd]
+            keys = list(map(tuple, positions.astype(int, copy=False).tolist()))
+            if structure._blockEntities:
+                for pos in keys:
+                    structure._blockEntities.pop(pos, None)
+            structure._blockStates.update(zip(keys, map(blockDatas.__getitem__, blockData)))
+
+    def _setBlockStates(self, positions: np.ndarray | Iterable[tuple[int, int, int]], blockState: str):
+        """
+        Set a single block state (no block entity data) at every (x,y,z) in positions in one dict update.
+        positions is an (N, 3) array or an iterable of (x, y, z) tuples.
+        """
+        structure = self._structure
+        structure._addBlockStateToPaletteIfAbsent(blockState)
+        blockPaletteId = structure._blockPalette[blockState]
+        if isinstance(positions, np.ndarray):
+            positions = map(tuple, positions.astype(int, copy=False).tolist())
+        if structure._blockEntities:
+            positions = list(positions)
+            for pos in positions:
+                structure._blockEntities.pop(pos, None)
+        structure._blockStates.update(dict.fromkeys(positions, blockPaletteId))
+
+    @staticmethod
+    def _getFilledBox(volumeMask: np.ndarray) -> tuple[tuple[int, int, int], tuple[int, int, int]] | None:
+        """If the True voxels of volumeMask form one solid cuboid, return its (min, max) corners with max exclusive."""
+        count = np.count_nonzero(volumeMask)
+        if count == 0:
+            return None
+        mins, maxs = [], []
+        for axis in range(3):
+            occupied = np.flatnonzero(volumeMask.any(axis=tuple(a for a in range(3) if a != axis)))
+            mins.append(int(occupied[0]))
+            maxs.append(int(occupied[-1]) + 1)
+        if count != np.prod(np.subtract(maxs, mins)):
+            return None
+        return tuple(mins), tuple(maxs)
+
+    def _getBlockArrays(self) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Return the block states as parallel arrays: a (3, N) int32 array of x, y, z rows and
+        an (N,) array of the corresponding block palette ids, in the dtype given by _getPaletteIdDtype.
+        """
+        blockStates = self._structure._blockStates
+        n = len(blockStates)
+        positions = np.fromiter(itertools.chain.from_iterable(blockStates.keys()), dtype=np.int32, count=3*n)
+        positions = np.ascontiguousarray(positions.reshape(n, 3).T)
+        blockPaletteIds = np.fromiter(blockStates.values(), dtype=self._getPaletteIdDtype(), count=n)
+        return positions, blockPaletteIds
+
+    def _getPaletteIdDtype(self) -> np.dtype:
+        """
+        Smallest unsigned integer dtype that holds every block palette id. Palettes are usually small, so palette id
+        arrays are mostly uint8 or uint16, and every pass over them moves a fraction of the bytes of int32 ids.
+        """
+        # ids are handed out in increasing order and not reused when replaceBlocks removes an entry,
+        # so size the dtype from the last id assigned rather than the palette length
+        return np.min_scalar_type(max(self._structure._blockPaletteFreeId - 1, 0))
+
+    def _getBounds(self, positions: np.ndarray | None = None) -> tuple[tuple[int, int, int], tuple[int, int, int]]:
+        """Vectorized equivalent of MCStructure.getBounds (inclusive min and max corners)."""
+        if positions is None:
+            positions, _ = self._getBlockArrays()
+        if positions.shape[1] == 0:
+            return (0, 0, 0), (0, 0, 0)
+        return tuple(positions.min(axis=1).tolist()), tuple(positions.max(axis=1).tolist())
+
+    def _getEncodedBlockStates(self, cleanBlockPaletteLen: int, schemDims: tuple[int, int, int],
+                               schemOffset: tuple[int, int, int], fastSaving: bool,
+                               blockArrays: tuple[np.ndarray, np.ndarray] | None = None):
+        """
+        Vectorized MCSchematic._getEncodedBlockStates: scatter the palette ids into a (y, z, x) ordered grid in one
+        pass instead of writing the blocks into the byte array one at a time, then encode the whole grid as varints.
+        """
+        positions, blockPaletteIds = self._getBlockArrays() if blockArrays is None else blockArrays
+        rel = positions - np.array(schemOffset, dtype=positions.dtype)[:, None]
+        flat = (rel[1].astype(np.intp) * schemDims[2] + rel[2]) * schemDims[0] + rel[0]
+        grid = np.zeros(schemDims[0] * schemDims[1] * schemDims[2], dtype=np.min_scalar_type(cleanBlockPaletteLen - 1))
+        grid[flat] = blockPaletteIds
+        if cleanBlockPaletteLen <= 128:
+            # every palette id fits in a single varint byte
+            return grid.view(np.int8)
+        if not fastSaving:
+            return self._encodeVarints(grid).view(np.int8)
+        # fastSaving: every id takes the same number of bytes, so encode the palette once and gather
+        bitsNeeded = math.floor(math.log2(max(cleanBlockPaletteLen - 1, 1)) + 1)
+        bytesNeeded = math.ceil(bitsNeeded / 7)
+        varints = np.frombuffer(b"".join(self._VarintIO.getPositiveVarIntFixedLength(i, bytesNeeded)
+                                         for i in range(cleanBlockPaletteLen)), dtype=np.uint8)
+        varints = varints.reshape(cleanBlockPaletteLen, bytesNeeded)
+        return varints[grid].reshape(-1).view(np.int8)
+
+    @staticmethod
+    def _encodeVarints(values: np.ndarray) -> np.ndarray:
+        """Encode non-negative integers as consecutive LEB128 varints, one pass per byte position."""
+        values = values.astype(np.int64, copy=False)
+        byteCounts = np.ones(len(values), dtype=np.int64)
+        for shift in range(7, 64, 7):
+            more = values >> shift != 0
+            if not more.any():
+                break
+            byteCounts += more
+        starts = np.cumsum(byteCounts) - byteCounts
+        encoded = np.empty(int(byteCounts.sum()), dtype=np.uint8)
+        for k in range(int(byteCounts.max(initial=1))):
+            has = np.flatnonzero(byteCounts > k)
+            groups = (values[has] >> (7*k)) & 0x7F
+            continued = np.where(byteCounts[has] > k + 1, 0x80, 0)
+            encoded[starts[has] + k] = groups | continued
+        return encoded
 
     def getBlocks(self):
         """Return a dictionary of positions to block names."""
@@ -132,11 +408,20 @@ class MCSchematicPlus(MCSchematic):
     def splitByBlock(self):
         """Return a dictionary of block names and corresponding MCSchematicPlus objects."""
         block_dict : dict[str, MCSchematicPlus] = {}
-        for pos, blockPaletteId in self._structure.getBlockStates().items():
-            block_name = self._structure._blockPalette[blockPaletteId]
-            if block_name not in block_dict:
-                block_dict[block_name] = MCSchematicPlus()
-            block_dict[block_name].setBlock(pos, block_name) # TODO slightly inefficient but simple
+        blockStates = self._structure._blockStates
+        # The children reuse this structure's position tuples rather than building new ones
+        keys = list(blockStates.keys())
+        blockPaletteIds = np.fromiter(blockStates.values(), dtype=self._getPaletteIdDtype(), count=len(keys))
+        # Group the blocks by palette id; the stable sort keeps each group in the original order
+        order = np.argsort(blockPaletteIds, kind="stable")
+        uniq, group_starts = np.unique(blockPaletteIds[order], return_index=True)
+        group_ends = np.append(group_starts[1:], len(order))
+        # Emit the groups in order of first appearance, as iterating the block states would
+        for k in np.argsort(order[group_starts], kind="stable").tolist():
+            block_name = self._structure._blockPalette[int(uniq[k])]
+            child = MCSchematicPlus()
+            child._setBlockStates(map(keys.__getitem__, order[group_starts[k]:group_ends[k]].tolist()), block_name)
+            block_dict[block_name] = child
         return block_dict
     
     def getLatestVersion(self) -> 'Version':
@@ -158,7 +443,8 @@ class MCSchematicPlus(MCSchematic):
             version = self.getLatestVersion()
         #################### Start copied from MCSchematic #####################
         ## Setup
-        schemBounds = self._structure.getBounds()
+        blockArrays = self._getBlockArrays()
+        schemBounds = self._getBounds(blockArrays[0])
         schemDims = self._structure.getStructureDimensions(schemBounds)
         # The vector amount by which minBounds is offsetted from 0 0 0
         schemOffset = schemBounds[0]
@@ -167,17 +453,26 @@ class MCSchematicPlus(MCSchematic):
         ## We're doing the block palette early because it's gonna
         ## be useful in knowing which algorithm to use in when saving
         ## the blocks to the schematic
-        # Get a cleaner version of the block palette, without the duplicates used
-        # for back and forth O(1) access
-        self._structure.getBlockPalette()
-        cleanBlockPalette = self._structure.getBlockPalette()
+        # Only the palette ids still in use are kept (air stays at 0, the byte array's fill value), renumbered
+        # densely so overwritten blocks do not inflate the palette or push the ids into multi-byte varints.
+        # replaceBlocks can leave several ids mapped to the same block state, so those share one entry.
+        positions, blockPaletteIds = blockArrays
+        usedIds, compactIds = np.unique(np.r_[0, blockPaletteIds], return_inverse=True)
+        blockPalette = self._structure._blockPalette
+        cleanBlockPalette = {}
+        cleanIds = np.array([cleanBlockPalette.setdefault(blockPalette[blockPaletteId], len(cleanBlockPalette))
+                             for blockPaletteId in usedIds.tolist()])
+        cleanIds = cleanIds.astype(np.min_scalar_type(len(cleanBlockPalette) - 1))
+        blockArrays = (positions, cleanIds[compactIds.reshape(-1)[1:]])
+        cleanBlockPalette = {blockState: Int(k) for blockState, k in cleanBlockPalette.items()}
 
 
         ## BLOCK DATA
         encodedBlockStates = self._getEncodedBlockStates(len(cleanBlockPalette),
                                                          schemDims,
                                                          schemOffset,
-                                                         fastSaving)
+                                                         fastSaving,
+                                                         blockArrays)
 
 
         ## BLOCK ENTITIES
@@ -223,10 +518,11 @@ class MCSchematicPlus(MCSchematic):
         }, gzipped=True, root_name='Schematic')
         #################### End copied from MCSchematic #####################
 
-        schematic.save(filepath)
+        # a fixed mtime makes saving the same structure twice produce identical files
+        _writeGzippedNBT(schematic, filepath, mtime=0)
         
 
-    def saveNBT(self, filepath: str | os.PathLike, version : 'Version' = None, maxSize: int | tuple[int, int, int] | None = None, filenameMode: str = "auto"):
+    def saveNBT(self, filepath: str | os.PathLike, version : 'Version' = None, maxSize: int | tuple[int, int, int] | None = None, filenameMode: str = "auto", maxWorkers: int | None = 1, skipEmpty: bool = False):
         """
         Save the structure as one or more Minecraft schematic .nbt files in <directory>.
         If the structure exceeds maxSize in any dimension, it will be split into multiple files.
@@ -243,15 +539,20 @@ class MCSchematicPlus(MCSchematic):
         filenameMode : str, optional
             "auto" (default): use base_name.nbt if only one file is needed, otherwise use indexed names.
             "indexed": always use indexed names.
+        maxWorkers : int | None, optional
+            Number of threads used to encode, compress and write tiles in parallel. If None, uses the
+            ThreadPoolExecutor default. Default is 1, which writes the tiles one after another.
+        skipEmpty : bool, optional
+            If True, tiles without any blocks are not written. Default is False.
         """
         directory = os.path.dirname(filepath)
         base_name = os.path.splitext(os.path.basename(filepath))[0]
-        if not os.path.exists(directory):
-            os.makedirs(directory)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
         if version is None:
             version = self.getLatestVersion()
-        x_min, y_min, z_min = self._structure.getBounds()[0]
-        x_max, y_max, z_max = self._structure.getBounds()[1]
+        positions, blockPaletteIds = self._getBlockArrays()
+        (x_min, y_min, z_min), (x_max, y_max, z_max) = self._getBounds(positions)
         size_x, size_y, size_z = x_max - x_min, y_max - y_min, z_max - z_min
         if maxSize is None:
             maxSize = (size_x, size_y, size_z)
@@ -261,75 +562,61 @@ class MCSchematicPlus(MCSchematic):
         ny = (size_y + maxSize[1] - 1) // maxSize[1]
         nz = (size_z + maxSize[2] - 1) // maxSize[2]
 
-        for ix in range(nx):
-            for iy in range(ny):
-                for iz in range(nz):
-                    x0, y0, z0 = ix*maxSize[0] + x_min, iy*maxSize[1] + y_min, iz*maxSize[2] + z_min
-                    x1, y1, z1 = min(x0+maxSize[0], x_max), min(y0+maxSize[1], y_max), min(z0+maxSize[2], z_max)
-                    tile_size = (x1-x0, y1-y0, z1-z0)
-
-                    root = Compound()
-                    root["DataVersion"] = Int(version.value)
-                    root["size"] = List[Int]([Int(tile_size[0]), Int(tile_size[1]), Int(tile_size[2])])
-
-                    # Palette
-                    palette = List[Compound]()
-                    palette_index = {}
-                    # Always include air
-                    palette.append(Compound({"Name": String("minecraft:air")}))
-                    palette_index["minecraft:air"] = 0
-                    next_index = 1
-
-                    # Blocks
-                    blocks = List[Compound]()
-                    
-                    for (x,y,z), block in self.getBlocks().items():
-                        if x0 <= x < x1 and y0 <= y < y1 and z0 <= z < z1:
-                            rel = (x-x0, y-y0, z-z0)
-                            
-                            if block not in palette_index:
-                                block_name = block.split("[")[0]
-                                entry = Compound({"Name": String(block_name)})
-                                if block.find("[") != -1:
-                                    props_str = block[block.find("[")+1:block.find("]")]
-                                    props = Compound()
-                                    for prop in props_str.split(","):
-                                        if "=" in prop: # Safety check for malformed strings
-                                            key, value = prop.split("=")
-                                            props[key] = String(value)
-                                    entry["Properties"] = props
-                                palette.append(entry)
-                                palette_index[block] = next_index
-                                next_index += 1
-                            
-                            state = palette_index[block]
-                            btag = Compound()
-                            btag["state"] = Int(state)
-                            btag["pos"] = List[Int]([Int(rel[0]), Int(rel[1]), Int(rel[2])])
-                            
-                            if (x,y,z) in self._structure._blockEntities:
-                                blockEntityString = self._structure._blockEntities[(x,y,z)]
-                                if "{" in blockEntityString:
-                                    nbtPortion = blockEntityString[blockEntityString.find("{"):] 
-                                    btag["nbt"] = parse_nbt(nbtPortion)
-                                    
-                            blocks.append(btag)
-
-                    root["palette"] = palette
-                    root["blocks"] = blocks
-                    root["entities"] = List[Compound]() # TODO: Add support for entities
-
-                    # Save
-                    if nx>1 or ny>1 or nz>1 or filenameMode == "indexed":
-                        fname = f"{base_name}_{ix}_{iy}_{iz}.nbt"
-                    elif filenameMode == "auto":
-                        fname = f"{base_name}.nbt"
-                    path = os.path.join(directory, fname)
-                    
-                    nbt_file = File(root, gzipped=True, root_name="Schematic")
-                    nbt_file.save(path)
-
-    def toMesh(self, blockColormap: str | BlockColormap | None = "all") -> pv.UnstructuredGrid:
+        # Bin every block into its tile once so each tile visits only its own blocks
+        rel = positions - np.array([[x_min], [y_min], [z_min]])
+        inside = np.flatnonzero(np.all(rel < np.array([[size_x], [size_y], [size_z]]), axis=0))
+        tile = rel[:, inside] // np.array(maxSize)[:, None]
+        tile_ids = (tile[0]*ny + tile[1])*nz + tile[2]
+        order = np.argsort(tile_ids, kind="stable")
+        tile_order = inside[order]
+        tile_starts = np.searchsorted(tile_ids[order], np.arange(nx*ny*nz + 1))
+        if skipEmpty:
+            # the sorted ids give the non-empty tiles directly, so empty tiles are never visited
+            tile_id_list = np.unique(tile_ids).tolist()
+        else:
+            tile_id_list = range(nx*ny*nz)
+        blockPalette = self._structure._blockPalette
+        blockEntities = self._structure._blockEntities
+
+        # The path prefix is joined once; only the tile index suffix is formatted per tile, so a "%" in the
+        # directory or file name is never read as a format character
+        indexed = nx>1 or ny>1 or nz>1 or filenameMode == "indexed"
+        path_prefix = os.path.join(directory, base_name)
+
+        tiles = []
+        for tile_id in tile_id_list:
+            ix, iy, iz = tile_id // (ny*nz), tile_id // nz % ny, tile_id % nz
+            tile_blocks = tile_order[tile_starts[tile_id]:tile_starts[tile_id+1]]
+            x0, y0, z0 = ix*maxSize[0] + x_min, iy*maxSize[1] + y_min, iz*maxSize[2] + z_min
+            x1, y1, z1 = min(x0+maxSize[0], x_max), min(y0+maxSize[1], y_max), min(z0+maxSize[2], z_max)
+            tile_size = (x1-x0, y1-y0, z1-z0)
+
+            # Only the tile's own blocks, palette entries and block entities are handed to the writer
+            tile_positions = positions[:, tile_blocks]
+            tile_palette_ids = blockPaletteIds[tile_blocks]
+            tile_palette = {blockPaletteId: blockPalette[blockPaletteId] for blockPaletteId in np.unique(tile_palette_ids).tolist()}
+            tile_entities = {}
+            if blockEntities:
+                for i, pos in enumerate(map(tuple, tile_positions.T.tolist())):
+                    if pos in blockEntities and "{" in blockEntities[pos]:
+                        tile_entities[i] = blockEntities[pos]
+            tile_rel = tile_positions - np.array([[x0], [y0], [z0]], dtype=tile_positions.dtype)
+
+            # Save
+            path = path_prefix + ("_%d_%d_%d.nbt" % (ix, iy, iz) if indexed else ".nbt")
+            tiles.append((path, version.value, tile_size, tile_rel, tile_palette_ids, tile_palette, tile_entities))
+
+        if maxWorkers == 1 or len(tiles) <= 1:
+            for args in tiles:
+                _saveNBTTile(*args)
+        else:
+            # encoding is done by numpy and compression by zlib, which both release the GIL,
+            # so threads overlap the tiles' work without pickling their arrays to other processes
+            with ThreadPoolExecutor(max_workers=maxWorkers) as executor:
+                for future in [executor.submit(_saveNBTTile, *args) for args in tiles]:
+                    future.result()
+
+    def toMesh(self, blockColormap: str | BlockColormap | None = "all") -> 'pv.UnstructuredGrid':
         """
         Convert to a pyvista UnstructuredGrid mesh for visualization.
 
@@ -343,38 +630,56 @@ class MCSchematicPlus(MCSchematic):
         -------
         pyvista.UnstructuredGrid
         """
-        bounds = np.array(self.getStructure().getBounds())
+        import pyvista as pv
+        positions, blockPaletteIds = self._getBlockArrays()
+        bounds = np.array(self._getBounds(positions))
         shape = bounds[1] - bounds[0] + 1 # +1 because bounds are inclusive
-        blocks = self.getBlocks()
         cmap = get_block_colormap(blockColormap) if blockColormap is not None else None
-        mask_3d = np.zeros(shape, dtype=bool)
+        # VTK cell data is x-fastest, so index the grids (z, y, x): the C-order ravel is then already in cell order
+        rel = positions - bounds[0][:, None]
+        zyx = (rel[2], rel[1], rel[0])
+        mask_3d = np.zeros(shape[::-1], dtype=bool)
+        mask_3d[zyx] = blockPaletteIds != 0 # air is always palette id 0
         if cmap is not None:
-            rgba_3d = np.zeros(tuple(shape) + (4,), dtype=np.uint8)
-        missing_blocks = set()
-        for pos, block in blocks.items():
-            if block == "minecraft:air":
-                continue
-            pos = tuple(np.array(pos) - bounds[0])
-            mask_3d[pos] = True
-            if cmap is not None:
+            # look up each palette entry once and gather, instead of one lookup per block
+            blockPalette = self._structure._blockPalette
+            blockEntities = self._structure._blockEntities
+            # palette ids used by at least one block without nbt (blocks with nbt are colored separately below)
+            counts = np.bincount(blockPaletteIds, minlength=self._structure._blockPaletteFreeId)
+            for pos in blockEntities:
+                counts[self._structure._blockStates[pos]] -= 1
+            counts[0] = 0
+            rgba_lut = np.zeros((len(counts), 4), dtype=np.uint8)
+            missing_blocks = set()
+            for blockPaletteId in np.flatnonzero(counts).tolist():
+                try:
+                    rgba_lut[blockPaletteId] = cmap.get_rgba(blockPalette[blockPaletteId])
+                except KeyError:
+                    missing_blocks.add(blockPalette[blockPaletteId])
+            rgba_3d = np.zeros(tuple(shape[::-1]) + (4,), dtype=np.uint8)
+            rgba_3d[zyx] = rgba_lut[blockPaletteIds]
+            # blocks with nbt are looked up by their full block data, as getBlockDataAt returns it
+            for pos, blockData in blockEntities.items():
+                x, y, z = np.array(pos) - bounds[0]
                 try:
-                    rgba_3d[pos] = cmap.get_rgba(block)
+                    rgba_3d[z, y, x] = cmap.get_rgba(blockData)
                 except KeyError:
-                    missing_blocks.add(block)
-        if missing_blocks:
-            warnings.warn(f"Skipping blocks not found in colormap: {missing_blocks}")
+                    rgba_3d[z, y, x] = 0
+                    missing_blocks.add(blockData)
+            if missing_blocks:
+                warnings.warn(f"Skipping blocks not found in colormap: {missing_blocks}")
 
         grid = pv.ImageData(dimensions=np.array(shape)+1, spacing=(1, 1, 1))
 
-        grid.cell_data["mask"] = mask_3d.flatten(order='F')
+        grid.cell_data["mask"] = mask_3d.ravel()
         if cmap is not None:
-            grid.cell_data["colors"] = rgba_3d.reshape(-1, 4, order='F')
+            grid.cell_data["colors"] = rgba_3d.reshape(-1, 4)
         mesh: pv.UnstructuredGrid = grid.threshold(0.5, scalars="mask", invert=False)
         mesh.cell_data.pop("mask")
         mesh.translate(bounds[0], inplace=True) # translate back to world coordinates
         return mesh
     
-    def show(self, blockColormap: str | BlockColormap | None = "all", plotter: pv.Plotter | None = None, display: bool = True, **kwargs):
+    def show(self, blockColormap: str | BlockColormap | None = "all", plotter: 'pv.Plotter | None' = None, display: bool = True, **kwargs):
         """
         Visualize using pyvista.
 
@@ -394,6 +699,7 @@ class MCSchematicPlus(MCSchematic):
         -------
         pyvista.Plotter
         """
+        import pyvista as pv
         mesh = self.toMesh(blockColormap=blockColormap)
         p = plotter if plotter is not None else pv.Plotter()
         if blockColormap is None:
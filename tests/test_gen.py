@@ -1,9 +1,20 @@
+from functools import lru_cache
+import glob
+import shutil
 import numpy as np
-from mcschematic_plus import MCSchematicPlus, read_tiff, read_mesh
+from mcschematic_plus import MCSchematicPlus, read_tiff, read_mesh, voxelize_mesh, to_mc_volume, to_mc_bool_volume
 from nbtlib import load
 
 OUTPUT_DIR = "tests/output"
 
+@lru_cache(maxsize=None)
+def large_volume() -> np.ndarray:
+    """100^3 volume with a solid 80^3 interior, built once and shared read-only between tests."""
+    vol = np.zeros((100, 100, 100), dtype=bool)
+    vol[10:90, 10:90, 10:90] = True
+    vol.flags.writeable = False
+    return vol
+
 def test_small_volume():
     vol = np.zeros((10, 10, 10), dtype=bool)
     vol[1:5, 1:5, 1:5] = True
@@ -14,11 +25,32 @@ def test_small_volume():
     # try to load the nbt
     load(f"{OUTPUT_DIR}/small.nbt")
 
+def test_skip_empty():
+    # two distant cubes leave most tiles empty; written to a fresh directory so earlier runs cannot add files
+    output_dir = f"{OUTPUT_DIR}/sparse"
+    shutil.rmtree(output_dir, ignore_errors=True)
+    vol = np.zeros((10, 10, 10), dtype=bool)
+    vol[1:5, 1:5, 1:5] = True
+    schem = MCSchematicPlus()
+    schem.placeVolume(vol, "minecraft:stone")
+    schem.placeVolume(vol, "minecraft:stone", placePosition=(16, 16, 16))
+    schem.saveNBT(f"{output_dir}/sparse.nbt", maxSize=4, filenameMode="indexed", skipEmpty=True)
+    assert len(glob.glob(f"{output_dir}/sparse_*.nbt")) == 2
+
+def test_percent_path():
+    # "%" in the directory or file name must be written literally
+    vol = np.zeros((10, 10, 10), dtype=bool)
+    vol[1:5, 1:5, 1:5] = True
+    schem = MCSchematicPlus()
+    schem.placeVolume(vol, "minecraft:stone")
+    schem.saveNBT(f"{OUTPUT_DIR}/50%_done/x%y.nbt")
+    schem.saveNBT(f"{OUTPUT_DIR}/50%_done/x%y.nbt", filenameMode="indexed")
+    load(f"{OUTPUT_DIR}/50%_done/x%y.nbt")
+    load(f"{OUTPUT_DIR}/50%_done/x%y_0_0_0.nbt")
+
 def test_large_volume():
-    vol = np.zeros((100, 100, 100), dtype=bool)
-    vol[10:90, 10:90, 10:90] = True
     schem = MCSchematicPlus()
-    schem.placeVolume(vol, "minecraft:dirt")
+    schem.placeVolume(large_volume(), "minecraft:dirt")
     schem.saveNBT(f"{OUTPUT_DIR}/large.nbt", maxSize=48)
     schem.save(f"{OUTPUT_DIR}/large.schem")
     # try to load the nbt
@@ -26,11 +58,39 @@ def test_large_volume():
 
 def test_tiff():
     vol = read_tiff("tests/data/blobs.tiff")
+    assert np.array_equal(read_tiff("tests/data/blobs.tiff", memmap=True), vol)
     schem = MCSchematicPlus()
     schem.placeVolume(vol, "minecraft:blue_stained_glass")
     schem.saveNBT(f"{OUTPUT_DIR}/tiff_blobs.nbt")
     schem.save(f"{OUTPUT_DIR}/tiff_blobs.schem")
 
+def test_tiff_threads():
+    # decoding pages on several threads must give the same volume as decoding them in order, every time
+    vol = read_tiff("tests/data/blobs.tiff", maxworkers=1)
+    for _ in range(20):
+        assert np.array_equal(read_tiff("tests/data/blobs.tiff", maxworkers=4), vol)
+
+def test_bool_volume():
+    arr = np.zeros((4, 5, 6), dtype=np.uint8)
+    arr[1, 2, 3] = 1
+    arr[2, 3, 4] = 2
+    vol = to_mc_bool_volume(arr)
+    assert vol.shape == (6, 4, 5)
+    assert vol.flags.c_contiguous
+    assert np.array_equal(vol, to_mc_volume(arr).astype(bool))
+    assert np.array_equal(to_mc_bool_volume(arr, true_value=2), to_mc_volume(arr) == 2)
+    packed = to_mc_bool_volume(arr, packed=True)
+    assert packed.shape == vol.shape
+    assert np.array_equal(np.asarray(packed), vol)
+    assert all(np.array_equal(a, b) for a, b in zip(packed.nonzero(), np.nonzero(vol)))
+    other = to_mc_bool_volume(arr, true_value=2, packed=True)
+    assert np.array_equal(np.asarray(packed | ~other), vol | ~np.asarray(other))
+    assert np.array_equal(np.asarray(packed - other), vol & ~np.asarray(other))
+    assert np.array_equal(np.asarray(packed & other), np.asarray(other))
+    schem = MCSchematicPlus()
+    schem.placeVolume(packed, "minecraft:stone")
+    assert len(schem.getBlocks()) == 2
+
 def test_split():
     dirt_vol = np.zeros((10, 10, 10), dtype=bool)
     dirt_vol[1:5, 1:5, 1:5] = True
@@ -71,6 +131,14 @@ def test_mesh_color():
     schem.saveNBT(f"{OUTPUT_DIR}/mesh_glycine.nbt")
     schem.save(f"{OUTPUT_DIR}/mesh_glycine.schem")
 
+def test_mesh_union():
+    # closed but self-intersecting: the distance changes sign away from the surface inside the overlap
+    import pyvista as pv
+    mesh = pv.Sphere(radius=0.5).merge(pv.Sphere(radius=0.25, center=(0, 0, -0.3)))
+    vol, _, _ = voxelize_mesh(mesh, spacing=0.04, fill=True, compute_scalars=False)
+    full, _, _ = voxelize_mesh(mesh, spacing=0.04, fill=True, compute_scalars=False, narrow_band=False)
+    assert np.array_equal(vol, full)
+
 def replace_test():
     vol = np.zeros((10, 10, 10), dtype=bool)
     vol[1:5, 1:5, 1:5] = True
@@ -83,6 +151,33 @@ def replace_test():
     blocks = schem.getBlocks()
     assert len(blocks) == 0
 
+def test_replace_into_existing():
+    # replacing a block with one already in the palette must not duplicate it in the saved palette
+    vol = np.zeros((10, 10, 10), dtype=bool)
+    vol[1:5, 1:5, 1:5] = True
+    schem = MCSchematicPlus()
+    schem.placeVolume(vol, "minecraft:stone")
+    schem.placeVolume(vol, "minecraft:dirt", placePosition=(4, 0, 0))
+    schem.replaceBlocks("minecraft:dirt", "minecraft:stone")
+    schem.saveNBT(f"{OUTPUT_DIR}/replace_existing.nbt")
+    names = [str(entry["Name"]) for entry in load(f"{OUTPUT_DIR}/replace_existing.nbt")["palette"]]
+    assert names == ["minecraft:air", "minecraft:stone"]
+    schem.save(f"{OUTPUT_DIR}/replace_existing.schem")
+    blocks = MCSchematicPlus(f"{OUTPUT_DIR}/replace_existing.schem").getBlocks()
+    assert len(blocks) == 128 and set(blocks.values()) == {"minecraft:stone"}
+
+def test_removed_palette_ids():
+    # removing blocks leaves gaps in the palette ids, so the highest id can exceed the palette size
+    schem = MCSchematicPlus()
+    for i in range(256):
+        schem.setBlock((i, 0, 0), f"minecraft:b{i}")
+    schem.replaceBlocks("minecraft:b0", None)
+    schem.replaceBlocks("minecraft:b1", None)
+    assert "minecraft:b255" in schem.splitByBlock()
+    schem.save(f"{OUTPUT_DIR}/removed_ids.schem")
+    blocks = MCSchematicPlus(f"{OUTPUT_DIR}/removed_ids.schem").getBlocks()
+    assert blocks[(255, 0, 0)] == "minecraft:b255"
+
 def test_schem():
     schem = MCSchematicPlus("tests/data/min_cell.schem")
     schem.saveNBT(f"{OUTPUT_DIR}/schem_cell.nbt")
@@ -100,12 +195,19 @@ def test_mcedit_schem():
 
 if __name__ == "__main__":
     test_small_volume()
+    test_skip_empty()
+    test_percent_path()
     test_large_volume()
     test_tiff()
+    test_tiff_threads()
+    test_bool_volume()
     test_split()
     test_mesh()
     test_mesh_color()
+    test_mesh_union()
     replace_test()
+    test_replace_into_existing()
+    test_removed_palette_ids()
     test_schem()
     test_mcedit_schem()
     print("All tests passed.")